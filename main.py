@@ -1,15 +1,18 @@
 import os
+import sqlite3
 import logging
 import discord
 import asyncio
-import pandas as pd
-from binance.client import Client
-from datetime import datetime
-import pytz
-import nest_asyncio
+from time import perf_counter
+import aiohttp
+from aiohttp import web
+import numpy as np
+import orjson
+from numba import njit
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from io import StringIO
 from typing import cast
-from flask import Flask
-from threading import Thread
 
 # Enable logging
 logging.basicConfig(level=logging.INFO)
@@ -17,76 +20,213 @@ logging.basicConfig(level=logging.INFO)
 # --- CONFIG ---
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 CHANNEL_ID = 1411642002319347784
-BINANCE_API_KEY = os.getenv("BINANCE_API_KEY")
-BINANCE_API_SECRET = os.getenv("BINANCE_API_SECRET")
 
-if not all([DISCORD_TOKEN, BINANCE_API_KEY, BINANCE_API_SECRET]):
-    raise ValueError("❌ Missing environment variables! Please set DISCORD_TOKEN, BINANCE_API_KEY, BINANCE_API_SECRET.")
-
-client = Client(BINANCE_API_KEY, BINANCE_API_SECRET)
+if not DISCORD_TOKEN:
+    raise ValueError("❌ Missing environment variable! Please set DISCORD_TOKEN.")
 
 TIMEFRAME = "1d"
 KLIMIT = 150
-SLEEP_SECONDS = 3600
+SCAN_DELAY_AFTER_CLOSE = timedelta(minutes=1)  # wait after the UTC daily close before scanning
+SCAN_RETRY_SECONDS = 300  # first retry after a failed scan, doubled per consecutive failure
+SCAN_RETRY_MAX_SECONDS = 3600
+MIN_FETCHED_RATIO = 0.8  # skip the post if fewer than this share of symbols were fetched
 MAX_FIELD_CHAR = 1000
 MAX_EMBED_FIELDS = 20
-REQUEST_SLEEP = 0.05
+MAX_CONCURRENT_REQUESTS = 20
+MIN_QUOTE_VOLUME = 1_000_000  # 24h USDT volume below which a symbol is skipped
+USED_WEIGHT_SOFT_LIMIT = 1000  # X-MBX-USED-WEIGHT-1M above which requests pause until the next minute
+MAX_RETRIES = 5
+BINANCE_BASE_URL = "https://api.binance.com"
+BINANCE_KLINES_URL = "/api/v3/klines"
+BINANCE_EXCHANGE_INFO_URL = "/api/v3/exchangeInfo"
+BINANCE_TICKER_24HR_URL = "/api/v3/ticker/24hr"
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "ma_cache.db")
+MANILA_TZ = ZoneInfo("Asia/Manila")
+
+# --- Shared HTTP session (created on first use, inside the running loop) ---
+session: aiohttp.ClientSession | None = None
+sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+def get_session() -> aiohttp.ClientSession:
+    global session
+    if session is None or session.closed:
+        # Every request goes to one Binance host: keep enough pooled TLS
+        # connections alive for a full fan-out so handshakes are paid once
+        session = aiohttp.ClientSession(
+            base_url=BINANCE_BASE_URL,
+            connector=aiohttp.TCPConnector(
+                limit_per_host=MAX_CONCURRENT_REQUESTS,
+                limit=64,
+                keepalive_timeout=60,
+                ttl_dns_cache=300,
+            ),
+            timeout=aiohttp.ClientTimeout(total=15),
+        )
+    return session
+
+# Loop time before which no new Binance request may start
+rate_limited_until = 0.0
+
+async def binance_get(path: str, params=None):
+    # Back off on Binance's own rate-limit signals instead of a fixed delay
+    global rate_limited_until
+    loop = asyncio.get_running_loop()
+    for attempt in range(MAX_RETRIES):
+        # Re-check after waking: another request may have pushed the deadline out
+        while (wait := rate_limited_until - loop.time()) > 0:
+            await asyncio.sleep(wait)
+        async with get_session().get(path, params=params) as resp:
+            if resp.status in (418, 429) and attempt < MAX_RETRIES - 1:
+                retry_after = float(resp.headers.get("Retry-After", 1))
+                delay = max(retry_after, 2 ** attempt)
+                logging.warning(f"Binance rate limit hit ({resp.status}), backing off {delay:.0f}s.")
+                rate_limited_until = max(rate_limited_until, loop.time() + delay)
+                continue
+            resp.raise_for_status()
+            if int(resp.headers.get("X-MBX-USED-WEIGHT-1M", 0)) > USED_WEIGHT_SOFT_LIMIT:
+                # Used weight is counted per clock minute; hold until the window resets
+                pause = 60 - datetime.now(timezone.utc).timestamp() % 60
+                rate_limited_until = max(rate_limited_until, loop.time() + pause)
+            return orjson.loads(await resp.read())
 
 # --- Load SPOT Symbols (instead of futures) ---
-exchange_info = client.get_exchange_info()
-spot_symbols = [
-    s["symbol"] for s in exchange_info["symbols"]
-    if s.get("quoteAsset") == "USDT" and s.get("status") == "TRADING"
-]
-logging.info(f"{len(spot_symbols)} USDT spot symbols loaded.")
+async def load_spot_symbols():
+    exchange_info = await binance_get(BINANCE_EXCHANGE_INFO_URL)
+    return [
+        s["symbol"] for s in exchange_info["symbols"]
+        if s.get("quoteAsset") == "USDT" and s.get("status") == "TRADING"
+    ]
+
+async def load_live_symbols():
+    # One bulk call for every symbol's 24h stats, used to drop illiquid pairs
+    tickers = await binance_get(BINANCE_TICKER_24HR_URL)
+    return {
+        t["symbol"] for t in tickers
+        if float(t.get("quoteVolume", 0)) > MIN_QUOTE_VOLUME
+    }
 
 # --- Indicator calculation ---
-def get_indicators(symbol: str):
+# symbol -> (open time of the live candle, closes of the completed candles before it)
+closes_cache: dict[str, tuple[int, np.ndarray]] = {}
+dirty_symbols: set[str] = set()
+
+# --- Persistent cache (survives restarts) ---
+cache_db = sqlite3.connect(CACHE_DB_PATH, isolation_level=None)
+cache_db.execute("PRAGMA journal_mode=WAL")
+cache_db.execute("CREATE TABLE IF NOT EXISTS closes(sym TEXT PRIMARY KEY, ts INTEGER, closes BLOB)")
+
+def load_closes_cache():
+    for sym, ts, blob in cache_db.execute("SELECT sym, ts, closes FROM closes"):
+        closes_cache[sym] = (ts, np.frombuffer(blob, dtype=np.float64))
+    logging.info(f"{len(closes_cache)} cached close histories loaded from {CACHE_DB_PATH}.")
+
+def save_closes_cache():
+    if not dirty_symbols:
+        return
+    cache_db.executemany(
+        "INSERT OR REPLACE INTO closes(sym, ts, closes) VALUES (?, ?, ?)",
+        [(sym, closes_cache[sym][0], closes_cache[sym][1].tobytes()) for sym in dirty_symbols],
+    )
+    dirty_symbols.clear()
+
+async def fetch_klines(symbol: str, limit: int):
+    async with sem:
+        params = {"symbol": symbol, "interval": TIMEFRAME, "limit": limit}
+        return await binance_get(BINANCE_KLINES_URL, params)
+
+async def get_closes(symbol: str):
     try:
-        candles = client.get_klines(symbol=symbol, interval=TIMEFRAME, limit=KLIMIT)
+        # Completed daily candles can't change until the next one opens, so
+        # probe the live candle plus the one before it and reuse the cached
+        # history when possible
+        candles = await fetch_klines(symbol, 2)
         if not candles:
             return None
-        column_names = [
-            'time', 'open', 'high', 'low', 'close',
-            'volume', 'close_time', 'quote_asset_volume',
-            'num_trades', 'taker_buy_base', 'taker_buy_quote', 'ignore'
-        ]
-        df = pd.DataFrame(candles, columns=column_names)
-        df['close'] = df['close'].astype(float)
-        df['MA20'] = df['close'].rolling(20, min_periods=1).mean()
-        df['MA50'] = df['close'].rolling(50, min_periods=1).mean()
-        df['MA100'] = df['close'].rolling(100, min_periods=1).mean()
-        return df.iloc[-1]
+        cached = closes_cache.get(symbol)
+        if cached is not None and cached[0] == candles[-1][0]:
+            history = cached[1]
+        elif cached is not None and len(candles) == 2 and cached[0] == candles[-2][0]:
+            # The previously live candle has just closed; roll it into the history
+            history = np.append(cached[1], float(candles[-2][4]))[-(KLIMIT - 1):]
+            closes_cache[symbol] = (candles[-1][0], history)
+            dirty_symbols.add(symbol)
+        else:
+            candles = await fetch_klines(symbol, KLIMIT)
+            if not candles:
+                return None
+            history = np.fromiter((float(c[4]) for c in candles[:-1]), dtype=np.float64, count=len(candles) - 1)
+            closes_cache[symbol] = (candles[-1][0], history)
+            dirty_symbols.add(symbol)
+        return np.append(history, float(candles[-1][4]))
     except Exception as e:
-        logging.debug(f"get_indicators({symbol}) error: {e}")
+        logging.debug(f"get_closes({symbol}) error: {e}")
         return None
 
-def is_aots(symbol: str):
-    latest = get_indicators(symbol)
-    if latest is None:
-        return False
-    try:
-        return latest['MA20'] > latest['MA50'] > latest['MA100']
-    except Exception:
-        return False
+@njit(cache=True)
+def aots_kernel(closes):
+    # One backwards pass per row over the last 100 closes, keeping the three
+    # running sums at once; NaN padding (short histories) is skipped
+    n, k = closes.shape
+    mask = np.zeros(n, dtype=np.bool_)
+    for r in range(n):
+        s20 = s50 = s100 = 0.0
+        c20 = c50 = c100 = 0
+        for j in range(min(k, 100)):
+            v = closes[r, k - 1 - j]
+            if np.isnan(v):
+                break
+            s100 += v
+            c100 += 1
+            if j < 50:
+                s50 += v
+                c50 += 1
+            if j < 20:
+                s20 += v
+                c20 += 1
+        if c20 > 0:
+            ma20, ma50, ma100 = s20 / c20, s50 / c50, s100 / c100
+            mask[r] = ma20 > ma50 and ma50 > ma100
+    return mask
+
+def find_aots(symbols, closes_list):
+    if not symbols:
+        return []
+    # Right-align every series in one matrix; newly listed pairs have fewer
+    # than KLIMIT candles, so pad with NaN and average whatever is available
+    closes = np.full((len(symbols), KLIMIT), np.nan, dtype=np.float64)
+    for row, c in zip(closes, closes_list):
+        row[-len(c):] = c[-KLIMIT:]
+    mask = aots_kernel(closes)
+    return [symbols[i] for i in np.nonzero(mask)[0]]
 
 # --- Helpers ---
+def seconds_until_next_scan():
+    # Daily candles only close at 00:00 UTC, so scan once per close
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight + SCAN_DELAY_AFTER_CLOSE - now).total_seconds()
+
 def chunk_symbols_into_fields(symbols, prefix="🟢 "):
-    fields, curr_list, curr_len, processed_count = [], [], len(prefix), 0
+    fields, processed_count = [], 0
+    buf, buf_len, first = StringIO(), len(prefix), True
+    buf.write(prefix)
     for sym in symbols:
-        token = (", " if curr_list else "") + sym
-        if curr_len + len(token) <= MAX_FIELD_CHAR:
-            curr_list.append(sym)
-            curr_len += len(token)
-            processed_count += 1
-        else:
-            fields.append(prefix + ", ".join(curr_list))
-            curr_list, curr_len = [sym], len(prefix) + len(sym)
-            processed_count += 1
+        add = len(sym) if first else len(sym) + 2
+        if buf_len + add > MAX_FIELD_CHAR and not first:
+            fields.append(buf.getvalue())
             if len(fields) >= MAX_EMBED_FIELDS:
                 break
-    if curr_list and len(fields) < MAX_EMBED_FIELDS:
-        fields.append(prefix + ", ".join(curr_list))
+            buf, buf_len, first = StringIO(), len(prefix), True
+            buf.write(prefix)
+            add = len(sym)
+        if not first:
+            buf.write(", ")
+        buf.write(sym)
+        buf_len += add
+        first = False
+        processed_count += 1
+    if not first and len(fields) < MAX_EMBED_FIELDS:
+        fields.append(buf.getvalue())
     remaining = len(symbols) - processed_count
     if remaining > 0:
         note = f"...and {remaining} more"
@@ -100,79 +240,127 @@ def chunk_symbols_into_fields(symbols, prefix="🟢 "):
 intents = discord.Intents.default()
 bot = discord.Client(intents=intents)
 
+# on_ready fires again after every gateway reconnect; only one scan loop may run
+scan_started = False
+
 @bot.event
 async def on_ready():
+    global scan_started
     logging.info(f"✅ Bot logged in as {bot.user}")
+    if scan_started:
+        return
     channel = cast(discord.TextChannel, bot.get_channel(CHANNEL_ID))
     if channel is None:
         logging.error(f"❌ Channel with ID {CHANNEL_ID} not found or bot lacks access.")
         return
+    scan_started = True
+    load_closes_cache()
 
+    spot_symbols: list[str] = []
+    failures = 0
     while True:
         try:
-            tier2 = []
-            for sym in spot_symbols:
-                if is_aots(sym):
-                    tier2.append(sym.replace("USDT", ""))
-                await asyncio.sleep(REQUEST_SLEEP)  # avoid API bans
-
-            manila = pytz.timezone("Asia/Manila")
-            now = datetime.now(manila).strftime("%I:%M:%S %p Manila Time")
-
-            embed = discord.Embed(
-                title=f"Automated AOTS Spot Setups — {now}",
-                description="**🎯 Tier 2 (AOTS)**\n20MA > 50MA > 100MA\nUSDT Spot Market",
-                color=0x00ff00
+            t0 = perf_counter()
+            if not spot_symbols:
+                # Loaded here so a failed load is retried like any failed scan
+                spot_symbols = await load_spot_symbols()
+                logging.info(f"{len(spot_symbols)} USDT spot symbols loaded.")
+            live = await load_live_symbols()
+            scan_symbols = [sym for sym in spot_symbols if sym in live]
+
+            # Fan out all symbols at once; the semaphore caps in-flight requests
+            results = await asyncio.gather(
+                *(get_closes(sym) for sym in scan_symbols), return_exceptions=True
             )
+            fetched = [
+                (sym, c) for sym, c in zip(scan_symbols, results)
+                if isinstance(c, np.ndarray) and c.size
+            ]
+            save_closes_cache()
+            if len(fetched) < MIN_FETCHED_RATIO * len(scan_symbols):
+                raise RuntimeError(
+                    f"Only {len(fetched)}/{len(scan_symbols)} symbols fetched; skipping post."
+                )
+
+            t1 = perf_counter()
+            hits = find_aots([sym for sym, _ in fetched], [c for _, c in fetched])
+            tier2 = [sym.replace("USDT", "") for sym in hits]
+
+            t2 = perf_counter()
+
+            now = datetime.now(MANILA_TZ).strftime("%I:%M:%S %p Manila Time")
 
             if tier2:
-                fields = chunk_symbols_into_fields(tier2, prefix="🟢 ")
-                for idx, val in enumerate(fields):
-                    name = f"TIER 2 (part {idx+1})" if len(fields) > 1 else "TIER 2"
-                    embed.add_field(name=name, value=val, inline=False)
+                values = chunk_symbols_into_fields(tier2, prefix="🟢 ")
+                fields = [
+                    {
+                        "name": f"TIER 2 (part {idx+1})" if len(values) > 1 else "TIER 2",
+                        "value": val,
+                        "inline": False,
+                    }
+                    for idx, val in enumerate(values)
+                ]
             else:
-                embed.add_field(name="TIER 2", value="No setups detected.", inline=False)
+                fields = [{"name": "TIER 2", "value": "No setups detected.", "inline": False}]
+
+            embed = discord.Embed.from_dict({
+                "title": f"Automated AOTS Spot Setups — {now}",
+                "description": "**🎯 Tier 2 (AOTS)**\n20MA > 50MA > 100MA\nUSDT Spot Market",
+                "color": 0x00ff00,
+                "fields": fields,
+            })
 
             await channel.send(embed=embed)
 
+            logging.info(
+                "scan: fetch=%.2fs compute=%.2fs send=%.2fs symbols=%d scanned=%d hits=%d",
+                t1 - t0, t2 - t1, perf_counter() - t2,
+                len(spot_symbols), len(fetched), len(tier2),
+            )
+            failures = 0
+
         except Exception as e:
+            failures += 1
             logging.exception("Unexpected error during scan loop.")
 
-        await asyncio.sleep(SLEEP_SECONDS)
-
-# --- Flask Uptime Server ---
-app = Flask('')
+        if failures:
+            # Retry a failed scan soon rather than losing the whole day's report
+            delay = min(
+                SCAN_RETRY_SECONDS * 2 ** (failures - 1),
+                SCAN_RETRY_MAX_SECONDS,
+                seconds_until_next_scan(),
+            )
+            logging.info(f"Retrying scan in {delay:.0f}s (attempt {failures + 1}).")
+        else:
+            delay = seconds_until_next_scan()
+        await asyncio.sleep(delay)
 
-@app.route('/')
-def home():
-    return "Bot is running!"
+# --- Uptime Server ---
+async def home(request):
+    return web.Response(text="Bot is running!")
 
-def run_web():
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 8080)))
+app = web.Application()
+app.router.add_get("/", home)
 
 # --- Main execution ---
-def start():
-    # Apply nest_asyncio to allow asyncio to be re-entered
-    nest_asyncio.apply()
-
-    # Get the event loop
-    loop = asyncio.get_event_loop()
+async def start():
+    # Serve the uptime endpoint on the same event loop as the bot
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "0.0.0.0", int(os.getenv("PORT", 8080)))
+    await site.start()
 
-    # Create a task for the bot
-    bot_task = loop.create_task(bot.start(DISCORD_TOKEN))
-
-    # Run both the Flask server and the bot concurrently
     try:
-        loop.run_until_complete(bot_task)
-    except KeyboardInterrupt:
-        pass
+        await bot.start(DISCORD_TOKEN)
     finally:
-        loop.run_until_complete(bot.close())
+        await bot.close()
+        if session is not None:
+            await session.close()
+        await runner.cleanup()
+        cache_db.close()
 
 if __name__ == "__main__":
-    # Start the Flask server in a separate thread
-    web_thread = Thread(target=run_web)
-    web_thread.start()
-    
-    # Start the bot
-    start()
+    try:
+        asyncio.run(start())
+    except KeyboardInterrupt:
+        pass